@@ -1,14 +1,18 @@
 import os
+import asyncio
 import hashlib
-from datetime import datetime, timedelta
+import hmac
+import time
+from datetime import timedelta
 from typing import Optional, Union
-from jose import JWTError, jwt
+import jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import Request
 from models import TokenData, UserInDB
 from dotenv import load_dotenv
-from passlib.context import CryptContext
+import bcrypt
+from cachetools import TTLCache
 
 # Load environment variables
 load_dotenv()
@@ -25,29 +29,64 @@ if not SECRET_KEY:
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
 
+# Verification key and algorithm list, built once instead of on every decode
+_VERIFY_KEY = SECRET_KEY.encode("utf-8")
+_VERIFY_ALGORITHMS = (ALGORITHM,)
+_DEFAULT_TOKEN_LIFETIME = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+
 # Token security
 security = HTTPBearer()
 # Optional token security for endpoints that may allow anonymous access (share links)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt work factor for new hashes; existing hashes below it are upgraded on login
+BCRYPT_ROUNDS = 12
+
+def _bcrypt_secret(password: str) -> bytes:
+    """Encode a password for bcrypt, which only uses the first 72 bytes."""
+    return password.encode("utf-8")[:72]
+
+# Caches in this app (these, shares.py, realtime_manager.py) are only used from
+# the event loop thread and never held across an await, so they take no locks.
+
+# Verified token cache: raw token -> (email, exp). Hits re-check `exp`, so a cached
+# entry never outlives its token. Failed verifications are never cached.
+_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+# Recently verified credentials: HMAC(stored_hash, password) -> (valid, upgraded_hash).
+# Keyed with SECRET_KEY so no password-derived value is kept in memory, and on the
+# stored hash so a password change invalidates it. Only successes are cached, so
+# wrong guesses always pay the full bcrypt cost.
+_credential_cache: TTLCache = TTLCache(maxsize=4096, ttl=30)
+
+def _credential_cache_key(plain_password: str, stored_hash: str) -> bytes:
+    """Derive the credential cache key for a password/hash pair."""
+    message = f"{stored_hash}\0{plain_password}".encode("utf-8")
+    return hmac.new(SECRET_KEY.encode("utf-8"), message, hashlib.sha256).digest()
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify password. Supports bcrypt (preferred) and legacy SHA-256 hashes."""
     try:
         if not hashed_password:
             return False
         # bcrypt hashes start with $2 (common prefixes: $2a$, $2b$, $2y$)
         if hashed_password.startswith("$2"):
-            return pwd_context.verify(plain_password, hashed_password)
-        # legacy SHA-256 hex
-        return hashlib.sha256(plain_password.encode("utf-8")).hexdigest() == hashed_password
+            # bcrypt releases the GIL; run it off the event loop
+            return await asyncio.to_thread(bcrypt.checkpw, _bcrypt_secret(plain_password), hashed_password.encode("utf-8"))
+        # legacy SHA-256 hex, compared in constant time
+        try:
+            stored_digest = bytes.fromhex(hashed_password)
+        except ValueError:
+            return False
+        digest = hashlib.sha256(plain_password.encode("utf-8")).digest()
+        return hmac.compare_digest(digest, stored_digest)
     except Exception:
         return False
 
-def get_password_hash(password: str) -> str:
+async def get_password_hash(password: str) -> str:
     """Hash a password using bcrypt."""
     try:
-        return pwd_context.hash(password)
+        hashed = await asyncio.to_thread(bcrypt.hashpw, _bcrypt_secret(password), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+        return hashed.decode("utf-8")
     except Exception:
         # Fallback for environments where bcrypt native deps are unavailable.
         # We support verifying legacy SHA-256 hashes in `verify_password`.
@@ -59,44 +98,56 @@ def needs_password_rehash(stored_hash: str) -> bool:
         if not stored_hash:
             return True
         if stored_hash.startswith("$2"):
-            return pwd_context.needs_update(stored_hash)
+            # $2b$<cost>$<salt+digest>
+            return int(stored_hash.split("$")[2]) < BCRYPT_ROUNDS
         # Anything else we treat as legacy
         return True
     except Exception:
         return True
 
-def verify_and_maybe_upgrade_password(plain_password: str, stored_hash: str) -> tuple[bool, Optional[str]]:
+async def verify_and_maybe_upgrade_password(plain_password: str, stored_hash: str) -> tuple[bool, Optional[str]]:
     """Verify password and return (valid, upgraded_hash_if_needed)."""
-    valid = verify_password(plain_password, stored_hash)
+    cache_key = _credential_cache_key(plain_password, stored_hash or "")
+    cached = _credential_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    valid = await verify_password(plain_password, stored_hash)
     if not valid:
         return False, None
-    if needs_password_rehash(stored_hash):
-        return True, get_password_hash(plain_password)
-    return True, None
+    upgraded_hash = await get_password_hash(plain_password) if needs_password_rehash(stored_hash) else None
+    _credential_cache[cache_key] = (True, upgraded_hash)
+    return True, upgraded_hash
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    lifetime = (expires_delta or _DEFAULT_TOKEN_LIFETIME).total_seconds()
+    # Integer epoch `exp` is what the JWT spec stores anyway; skip the datetime round-trip
+    payload = {**data, "exp": int(time.time() + lifetime)}
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 def verify_token(token: str) -> Optional[str]:
     """Verify a JWT token and return the email if valid."""
+    cached = _token_cache.get(token)
+    if cached is not None:
+        email, exp = cached
+        if exp > time.time():
+            return email
+        _token_cache.pop(token, None)
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, _VERIFY_KEY, algorithms=_VERIFY_ALGORITHMS)
         email: str = payload.get("sub")
         if email is None:
             return None
-        return email
-    except JWTError:
+    except jwt.PyJWTError:
         return None
 
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        _token_cache[token] = (email, exp)
+    return email
+
 async def get_current_user_email(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     """Get current user email from JWT token."""
     credentials_exception = HTTPException(
@@ -115,16 +166,14 @@ async def get_current_user_email(credentials: HTTPAuthorizationCredentials = Dep
 async def get_current_user_email_optional(request: Request) -> Optional[str]:
     """Optional variant: returns email string if Authorization: Bearer <token> present and valid; otherwise None.
     Returns None if no token is sent, but raises 401 if token is invalid/expired."""
-    auth_header = request.headers.get('authorization') or request.headers.get('Authorization')
-    if not auth_header:
-        return None
-    parts = auth_header.split()
-    if len(parts) != 2:
+    # Header lookup is case-insensitive; slice instead of split() to avoid a list per request
+    auth_header = request.headers.get('authorization')
+    if not auth_header or len(auth_header) < 8 or auth_header[:7].lower() != 'bearer ':
         return None
-    scheme, token = parts
-    if scheme.lower() != 'bearer':
+    token = auth_header[7:].strip()
+    if not token:
         return None
     email = verify_token(token)
     # If token was sent but is invalid, return None (let endpoint decide if 401 is appropriate)
     # This allows endpoints to check for share tokens before returning 401
-    return email
\ No newline at end of file
+    return email
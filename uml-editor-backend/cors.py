@@ -0,0 +1,89 @@
+"""
+CORS middleware written directly against ASGI
+Implements the API's fixed policy (any method, any request header, optional
+credentials) with every header value encoded once at startup, so a request only
+costs a scan of the raw header list and an append to the response headers.
+"""
+from typing import Iterable
+
+_VARY_ORIGIN = (b"vary", b"Origin")
+_PREFLIGHT_VARY = (b"vary", b"Origin, Access-Control-Request-Method, Access-Control-Request-Headers")
+_ALLOW_ALL_METHODS = (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT")
+_ALLOW_CREDENTIALS = (b"access-control-allow-credentials", b"true")
+_TEXT_PLAIN = (b"content-type", b"text/plain; charset=utf-8")
+
+
+class FastCORSMiddleware:
+    """Pure ASGI CORS middleware allowing all methods and headers for the given origins."""
+
+    def __init__(self, app, allow_origins: Iterable[str] = (), allow_credentials: bool = False, max_age: int = 600):
+        self.app = app
+        origins = frozenset(origin.encode("latin-1") for origin in allow_origins)
+        self.allow_all_origins = b"*" in origins
+        self.allow_origins = origins
+        # With credentials the origin must be echoed back; "*" is rejected by browsers
+        self.echo_origin = not self.allow_all_origins or allow_credentials
+
+        credentials = [_ALLOW_CREDENTIALS] if allow_credentials else []
+        self.simple_headers = [_VARY_ORIGIN, *credentials]
+        self.wildcard_headers = [(b"access-control-allow-origin", b"*"), _VARY_ORIGIN]
+        self.preflight_headers = [
+            _PREFLIGHT_VARY,
+            _ALLOW_ALL_METHODS,
+            (b"access-control-max-age", str(max_age).encode("latin-1")),
+            *credentials,
+            _TEXT_PLAIN,
+        ]
+
+    def is_allowed_origin(self, origin: bytes) -> bool:
+        """Check a raw Origin header value against the configured origins."""
+        return self.allow_all_origins or origin in self.allow_origins
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is not None and request_method is not None and scope["method"] == "OPTIONS":
+            await self.preflight(origin, request_headers, send)
+            return
+
+        if origin is None or not self.is_allowed_origin(origin):
+            extra_headers = [_VARY_ORIGIN]
+        elif self.echo_origin:
+            extra_headers = [(b"access-control-allow-origin", origin), *self.simple_headers]
+        else:
+            extra_headers = self.wildcard_headers
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *extra_headers]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+    async def preflight(self, origin: bytes, request_headers, send):
+        """Answer a CORS preflight request without calling into the app."""
+        if not self.is_allowed_origin(origin):
+            status, body = 400, b"Disallowed CORS origin"
+            headers = list(self.preflight_headers)
+        else:
+            status, body = 200, b"OK"
+            allow_origin = origin if self.echo_origin else b"*"
+            headers = [(b"access-control-allow-origin", allow_origin), *self.preflight_headers]
+            if request_headers is not None:
+                # All headers are allowed, so mirror back whatever was requested
+                headers.append((b"access-control-allow-headers", request_headers))
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -1,5 +1,7 @@
 import os
-from databases import Database
+from typing import Optional
+import asyncpg
+import orjson
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -21,18 +23,80 @@ else:
     # Extract DB_NAME from DATABASE_URL for logging
     DB_NAME = DATABASE_URL.split("/")[-1].split("?")[0] if "/" in DATABASE_URL else "uml_editor"
 
-# Create database instance
-database = Database(DATABASE_URL)
+# Pool tuning: keep warm connections for bursts, cap total connections below the
+# server limit, and recycle idle ones so stale sockets aren't handed out
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "5"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "20"))
+DB_POOL_MAX_IDLE_SECONDS = float(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "60"))
+
+# Connection pool, created on startup by connect_db()
+pool: Optional[asyncpg.Pool] = None
+
+# jsonb binary wire format is a one-byte version header followed by the JSON text
+_JSONB_VERSION = b"\x01"
+
+def _encode_jsonb(value) -> bytes:
+    """Encode a Python value straight to jsonb binary format with orjson."""
+    return _JSONB_VERSION + orjson.dumps(value)
+
+def _decode_jsonb(data: bytes):
+    """Decode jsonb binary format with orjson, skipping the version header."""
+    return orjson.loads(memoryview(data)[1:])
+
+async def _init_connection(conn: asyncpg.Connection):
+    """Per-connection setup: jsonb as Python objects, uuid as plain strings."""
+    # Binary format hands orjson's bytes to the driver as-is, with no str round-trip
+    await conn.set_type_codec(
+        "jsonb",
+        encoder=_encode_jsonb,
+        decoder=_decode_jsonb,
+        schema="pg_catalog",
+        format="binary",
+    )
+    # Models carry ids as str; decoding to str avoids a uuid.UUID -> str cast per column
+    await conn.set_type_codec(
+        "uuid",
+        encoder=str,
+        decoder=str,
+        schema="pg_catalog",
+        format="text",
+    )
 
 async def connect_db():
-    """Connect to the database."""
-    await database.connect()
+    """Create the database connection pool."""
+    global pool
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_IDLE_SECONDS,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        statement_cache_size=1024,
+        init=_init_connection,
+    )
     print(f"Connected to PostgreSQL database: {DB_NAME}")
 
 async def disconnect_db():
-    """Disconnect from the database."""
-    await database.disconnect()
+    """Close the database connection pool."""
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
     print("Disconnected from database")
 
-# Export database instance
-__all__ = ["database", "connect_db", "disconnect_db"]
\ No newline at end of file
+def get_pool() -> asyncpg.Pool:
+    """Return the active connection pool."""
+    if pool is None:
+        raise RuntimeError("Database pool is not initialized; call connect_db() first")
+    return pool
+
+def rows_affected(status: str) -> int:
+    """Parse the row count from an asyncpg command status such as 'DELETE 3'."""
+    try:
+        return int(status.rsplit(" ", 1)[-1])
+    except (ValueError, AttributeError):
+        return 0
+
+# Export pool helpers
+__all__ = ["get_pool", "rows_affected", "connect_db", "disconnect_db"]
\ No newline at end of file
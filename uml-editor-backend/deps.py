@@ -0,0 +1,33 @@
+from typing import Optional
+from fastapi import HTTPException, status, Depends, Request
+from models import UserInDB
+from auth import get_current_user_email, get_current_user_email_optional
+from users import get_user_by_email
+
+# User-resolving dependencies. They live here rather than in auth.py because
+# users.py imports auth for password hashing.
+
+async def _load_user(request: Request, email: str) -> UserInDB:
+    """Fetch the user for a verified email once per request, memoized on request.state."""
+    user = getattr(request.state, "user", None)
+    if user is not None and user.email == email:
+        return user
+    
+    user = await get_user_by_email(email)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    request.state.user = user
+    return user
+
+async def get_current_user(request: Request, email: str = Depends(get_current_user_email)) -> UserInDB:
+    """Get the current user from the JWT token, raising 401 if it is missing or invalid."""
+    return await _load_user(request, email)
+
+async def get_current_user_optional(request: Request, email: Optional[str] = Depends(get_current_user_email_optional)) -> Optional[UserInDB]:
+    """Optional variant of get_current_user: returns None when no valid token is sent."""
+    if email is None:
+        return None
+    return await _load_user(request, email)
\ No newline at end of file
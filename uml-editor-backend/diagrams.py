@@ -1,166 +1,111 @@
 from typing import List, Optional, Dict, Any
 from datetime import datetime
-import uuid
-import json
 from models import DiagramCreate, DiagramUpdate, Diagram
-from database import database
+from database import get_pool, rows_affected
+
+# id is omitted so Postgres fills it from the column default
+_SQL_CREATE_DIAGRAM = """
+    INSERT INTO diagrams (project_id, diagram_data, version, created_at, updated_at)
+    VALUES ($1, $2, $3, $4, $5)
+    RETURNING id, project_id, diagram_data, version, created_at, updated_at
+"""
+
+_SQL_GET_DIAGRAM_BY_ID = "SELECT id, project_id, diagram_data, version, created_at, updated_at FROM diagrams WHERE id = $1"
+
+# Postgres assembles the whole list as one jsonb value, so there is no
+# per-row hydration in Python; the rows already match the Diagram schema.
+_SQL_GET_DIAGRAMS_BY_PROJECT = """
+    SELECT jsonb_agg(
+        jsonb_build_object(
+            'id', id::text,
+            'project_id', project_id::text,
+            'diagram_data', diagram_data,
+            'version', version,
+            'created_at', created_at,
+            'updated_at', updated_at
+        )
+        ORDER BY created_at DESC
+    )
+    FROM diagrams WHERE project_id = $1
+"""
+
+# Ownership check and delete in one statement: only removes the row when its
+# project belongs to the given user.
+_SQL_DELETE_DIAGRAM = """
+    DELETE FROM diagrams d
+    USING projects p
+    WHERE d.id = $1 AND d.project_id = p.id AND p.owner_id = $2
+    RETURNING d.id
+"""
+
+_SQL_DELETE_DIAGRAMS_BY_PROJECT = "DELETE FROM diagrams WHERE project_id = $1"
+
+# Single round-trip: the version bump and the "keep current data" fallback
+# both happen in SQL. No row back means the diagram doesn't exist.
+_SQL_UPDATE_DIAGRAM = """
+    UPDATE diagrams
+    SET diagram_data = COALESCE($2::jsonb, diagram_data), version = version + 1, updated_at = $3
+    WHERE id = $1
+    RETURNING id, project_id, diagram_data, version, created_at, updated_at
+"""
 
 async def create_diagram(diagram_create: DiagramCreate) -> Diagram:
     """Create a new diagram."""
-    diagram_id = uuid.uuid4()
     created_at = datetime.utcnow()
     
-    query = """
-        INSERT INTO diagrams (id, project_id, diagram_data, version, created_at, updated_at)
-        VALUES (:id, :project_id, :diagram_data, :version, :created_at, :updated_at)
-        RETURNING id, project_id, diagram_data, version, created_at, updated_at
-    """
-    
-    result = await database.fetch_one(
-        query=query,
-        values={
-            "id": diagram_id,
-            "project_id": diagram_create.project_id,
-            "diagram_data": json.dumps(diagram_create.diagram_data) if diagram_create.diagram_data else None,
-            "version": 1,
-            "created_at": created_at,
-            "updated_at": created_at
-        }
-    )
-    
-    # Parse diagram_data from JSON string if it exists
-    diagram_data = None
-    if result["diagram_data"]:
-        if isinstance(result["diagram_data"], str):
-            diagram_data = json.loads(result["diagram_data"])
-        else:
-            diagram_data = result["diagram_data"]
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(
+            _SQL_CREATE_DIAGRAM,
+            diagram_create.project_id,
+            diagram_create.diagram_data or None,
+            1,
+            created_at,
+            created_at,
+        )
     
-    return Diagram(
-        id=str(result["id"]),
-        project_id=str(result["project_id"]),
-        diagram_data=diagram_data,
-        version=result["version"],
-        created_at=result["created_at"],
-        updated_at=result["updated_at"]
-    )
+    return Diagram(**result)
 
 async def get_diagram_by_id(diagram_id: str) -> Optional[Diagram]:
     """Get diagram by ID."""
-    query = "SELECT id, project_id, diagram_data, version, created_at, updated_at FROM diagrams WHERE id = :diagram_id"
-    result = await database.fetch_one(query=query, values={"diagram_id": diagram_id})
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(_SQL_GET_DIAGRAM_BY_ID, diagram_id)
     
     if result:
-        # Parse diagram_data from JSON string if it exists
-        diagram_data = None
-        if result["diagram_data"]:
-            if isinstance(result["diagram_data"], str):
-                diagram_data = json.loads(result["diagram_data"])
-            else:
-                diagram_data = result["diagram_data"]
-        
-        return Diagram(
-            id=str(result["id"]),
-            project_id=str(result["project_id"]),
-            diagram_data=diagram_data,
-            version=result["version"],
-            created_at=result["created_at"],
-            updated_at=result["updated_at"]
-        )
+        return Diagram(**result)
     return None
 
-async def get_diagrams_by_project(project_id: str) -> List[Diagram]:
+async def get_diagrams_by_project(project_id: str) -> List[Dict[str, Any]]:
     """Get all diagrams for a project."""
-    query = "SELECT id, project_id, diagram_data, version, created_at, updated_at FROM diagrams WHERE project_id = :project_id ORDER BY created_at DESC"
-    results = await database.fetch_all(query=query, values={"project_id": project_id})
+    async with get_pool().acquire() as conn:
+        diagrams = await conn.fetchval(_SQL_GET_DIAGRAMS_BY_PROJECT, project_id)
     
-    diagrams = []
-    for row in results:
-        # Parse diagram_data from JSON string if it exists
-        diagram_data = None
-        if row["diagram_data"]:
-            if isinstance(row["diagram_data"], str):
-                diagram_data = json.loads(row["diagram_data"])
-            else:
-                diagram_data = row["diagram_data"]
-        
-        diagrams.append(Diagram(
-            id=str(row["id"]),
-            project_id=str(row["project_id"]),
-            diagram_data=diagram_data,
-            version=row["version"],
-            created_at=row["created_at"],
-            updated_at=row["updated_at"]
-        ))
-    
-    return diagrams
+    return diagrams or []
 
 async def delete_diagram(diagram_id: str, user_id: str) -> bool:
     """Delete a specific diagram."""
-    # First get the diagram to verify ownership
-    diagram = await get_diagram_by_id(diagram_id)
-    if not diagram:
-        return False
-    
-    # Verify user owns the project
-    from projects import verify_project_owner
-    if not await verify_project_owner(diagram.project_id, user_id):
-        return False
-    
-    # Delete the diagram
-    query = "DELETE FROM diagrams WHERE id = :diagram_id"
-    result = await database.execute(query=query, values={"diagram_id": diagram_id})
+    async with get_pool().acquire() as conn:
+        deleted = await conn.fetchval(_SQL_DELETE_DIAGRAM, diagram_id, user_id)
     
-    return result > 0
+    return deleted is not None
 
 async def delete_diagrams_by_project(project_id: str) -> int:
     """Delete all diagrams for a project."""
-    query = "DELETE FROM diagrams WHERE project_id = :project_id"
-    result = await database.execute(query=query, values={"project_id": project_id})
-    return result
+    async with get_pool().acquire() as conn:
+        status = await conn.execute(_SQL_DELETE_DIAGRAMS_BY_PROJECT, project_id)
+    return rows_affected(status)
 
 async def update_diagram(diagram_id: str, diagram_update: DiagramUpdate) -> Optional[Diagram]:
     """Update a diagram."""
-    # First get the current version
-    current = await get_diagram_by_id(diagram_id)
-    if not current:
-        return None
-    
-    new_version = current.version + 1
     updated_at = datetime.utcnow()
     
-    query = """
-        UPDATE diagrams 
-        SET diagram_data = :diagram_data, version = :version, updated_at = :updated_at
-        WHERE id = :diagram_id
-        RETURNING id, project_id, diagram_data, version, created_at, updated_at
-    """
-    
-    result = await database.fetch_one(
-        query=query,
-        values={
-            "diagram_id": diagram_id,
-            "diagram_data": json.dumps(diagram_update.diagram_data) if diagram_update.diagram_data else json.dumps(current.diagram_data),
-            "version": new_version,
-            "updated_at": updated_at
-        }
-    )
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(
+            _SQL_UPDATE_DIAGRAM,
+            diagram_id,
+            diagram_update.diagram_data or None,
+            updated_at,
+        )
     
     if result:
-        # Parse diagram_data from JSON string if it exists
-        diagram_data = None
-        if result["diagram_data"]:
-            if isinstance(result["diagram_data"], str):
-                diagram_data = json.loads(result["diagram_data"])
-            else:
-                diagram_data = result["diagram_data"]
-        
-        return Diagram(
-            id=str(result["id"]),
-            project_id=str(result["project_id"]),
-            diagram_data=diagram_data,
-            version=result["version"],
-            created_at=result["created_at"],
-            updated_at=result["updated_at"]
-        )
+        return Diagram(**result)
     return None
\ No newline at end of file
@@ -41,9 +41,25 @@ CREATE TABLE IF NOT EXISTS shares (
     owner_id UUID REFERENCES users(id) ON DELETE SET NULL,
     diagram_data JSONB,
     expires_at TIMESTAMP,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    is_active BOOLEAN DEFAULT TRUE
 );
 
+-- Bring existing shares tables up to date: older deployments lack is_active
+-- and some stored diagram_data as TEXT. The backend expects JSONB everywhere.
+ALTER TABLE shares ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT TRUE;
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'shares' AND column_name = 'diagram_data' AND data_type <> 'jsonb'
+    ) THEN
+        ALTER TABLE shares ALTER COLUMN diagram_data TYPE JSONB USING diagram_data::jsonb;
+    END IF;
+END
+$$;
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_projects_owner_id ON projects(owner_id);
 CREATE INDEX IF NOT EXISTS idx_diagrams_project_id ON diagrams(project_id);
@@ -1,21 +1,24 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends, status, Request
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from datetime import timedelta
-import json
+import orjson
+import re
+import secrets
 import uuid
 import asyncio
 
 # Import our models and functions
-from models import UserCreate, UserLogin, Token, User, ProjectCreate, Project, DiagramCreate, DiagramUpdate, Diagram
+from models import UserCreate, UserLogin, Token, User, UserInDB, ProjectCreate, Project, DiagramCreate, DiagramUpdate, Diagram
 from auth import create_access_token, get_current_user_email, get_current_user_email_optional, ACCESS_TOKEN_EXPIRE_MINUTES
-from users import create_user, authenticate_user, get_user_by_email, user_to_dict
-from projects import create_project, get_projects_by_owner, get_project_by_id, verify_project_owner, create_project_with_default_diagram, delete_project
+from deps import get_current_user, get_current_user_optional
+from users import create_user, authenticate_user, user_to_dict
+from projects import create_project, get_projects_by_owner, verify_project_owner, verify_owner_by_email, get_project_for_email, create_project_with_default_diagram, delete_project
 from diagrams import create_diagram, get_diagrams_by_project, get_diagram_by_id, update_diagram, delete_diagram
 from database import connect_db, disconnect_db
 from shares import create_share, get_share_by_token
-from realtime_manager import add_listener, remove_listener, broadcast_update, get_last_update_time
+from realtime_manager import add_listener, remove_listener, wait_for_frames, broadcast_update, get_last_update_time, get_missed_frame, sse_frame
+from cors import FastCORSMiddleware
 
 # Lifespan event handler
 @asynccontextmanager
@@ -46,14 +49,38 @@ allow_credentials = True
 if "*" in cors_origins:
     allow_credentials = False
 
+# Pure ASGI CORS (all methods and headers allowed), see cors.py
 app.add_middleware(
-    CORSMiddleware,
+    FastCORSMiddleware,
     allow_origins=cors_origins,
     allow_credentials=allow_credentials,
-    allow_methods=["*"],
-    allow_headers=["*"],
 )
 
+_UUID_RE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.I)
+
+async def _resolve_diagram_id(maybe_id: str) -> str | None:
+    """Resolve a diagram id or share token (clients may send "shared-<token>" or just the token)."""
+    # Plain diagram UUIDs are the common case; match them without touching the DB
+    if _UUID_RE.fullmatch(maybe_id):
+        return maybe_id
+    # Other spellings uuid.UUID accepts (bare hex, braces, urn:uuid:) are still ids
+    try:
+        uuid.UUID(maybe_id)
+        return maybe_id
+    except ValueError:
+        pass
+    token = maybe_id
+    if token.startswith("shared-"):
+        token = token[len("shared-"):]
+    share = await get_share_by_token(token)
+    if not share:
+        return None
+    return share.get("diagram_id")
+
+def _json_list_response(items: list) -> Response:
+    """Serialize rows that already match the response schema, skipping model validation."""
+    return Response(content=orjson.dumps(items), media_type="application/json")
+
 # Root endpoint
 @app.get("/")
 async def read_root():
@@ -116,31 +143,18 @@ async def login_user(user_credentials: UserLogin):
         )
 
 @app.get("/me", response_model=User)
-async def get_current_user(current_user_email: str = Depends(get_current_user_email)):
+async def read_current_user(user: UserInDB = Depends(get_current_user)):
     """Get current user information."""
-    user = await get_user_by_email(current_user_email)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
     return user_to_dict(user)
 
 # Project endpoints
 @app.post("/projects", response_model=Project)
 async def create_new_project(
     project: ProjectCreate,
-    current_user_email: str = Depends(get_current_user_email)
+    user: UserInDB = Depends(get_current_user)
 ):
     """Create a new project with a default diagram."""
     try:
-        user = await get_user_by_email(current_user_email)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-        
         result = await create_project_with_default_diagram(project, user.id)
         return result
     except HTTPException:
@@ -152,16 +166,9 @@ async def create_new_project(
         )
 
 @app.get("/projects", response_model=list[Project])
-async def get_user_projects(current_user_email: str = Depends(get_current_user_email)):
+async def get_user_projects(user: UserInDB = Depends(get_current_user)):
     """Get all projects for the current user."""
-    user = await get_user_by_email(current_user_email)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    return await get_projects_by_owner(user.id)
+    return _json_list_response(await get_projects_by_owner(user.id))
 
 @app.get("/projects/{project_id}", response_model=Project)
 async def get_project(
@@ -169,14 +176,8 @@ async def get_project(
     current_user_email: str = Depends(get_current_user_email)
 ):
     """Get a specific project - users can only access their own projects."""
-    user = await get_user_by_email(current_user_email)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
-    project = await get_project_by_id(project_id)
+    # Project and ownership come back from one joined query
+    project, is_owner = await get_project_for_email(project_id, current_user_email)
     if not project:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -184,7 +185,6 @@ async def get_project(
         )
     
     # Verificar que el usuario es propietario del proyecto
-    is_owner = await verify_project_owner(project_id, user.id)
     if not is_owner:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -196,16 +196,9 @@ async def get_project(
 @app.delete("/projects/{project_id}")
 async def delete_project_endpoint(
     project_id: str,
-    current_user_email: str = Depends(get_current_user_email)
+    user: UserInDB = Depends(get_current_user)
 ):
     """Delete a project and all its diagrams."""
-    user = await get_user_by_email(current_user_email)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
     success = await delete_project(project_id, user.id)
     if not success:
         raise HTTPException(
@@ -222,15 +215,9 @@ async def create_new_diagram(
     current_user_email: str = Depends(get_current_user_email)
 ):
     """Create a new diagram - users can only create diagrams in their own projects."""
-    user = await get_user_by_email(current_user_email)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-
     # CRITICAL: Verify that the user owns the project before creating diagram
-    is_owner = await verify_project_owner(diagram.project_id, user.id)
+    # (user lookup and ownership check in one joined query)
+    is_owner = await verify_owner_by_email(diagram.project_id, current_user_email)
     if not is_owner:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -245,16 +232,12 @@ async def create_new_diagram(
 @app.post("/shares")
 async def create_new_share(
     payload: dict,
-    current_user_email: str = Depends(get_current_user_email)
+    user: UserInDB = Depends(get_current_user)
 ):
     """Create a persistent share token for a diagram.
     payload: { token?: string, diagram_id: string, expires_hours?: int }
     """
-    user = await get_user_by_email(current_user_email)
-    if not user:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
-
-    token = payload.get('token') or (str(uuid.uuid4()).replace('-', '')[:8].upper())
+    token = payload.get('token') or secrets.token_hex(4).upper()
     diagram_id = payload.get('diagram_id')
     expires_hours = payload.get('expires_hours')
 
@@ -285,21 +268,14 @@ async def get_project_diagrams(
     current_user_email: str = Depends(get_current_user_email)
 ):
     """Get all diagrams for a project - users can access their own projects."""
-    user = await get_user_by_email(current_user_email)
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    
     # Verificar si el usuario es propietario del proyecto
-    is_owner = await verify_project_owner(project_id, user.id)
+    is_owner = await verify_owner_by_email(project_id, current_user_email)
     
     if not is_owner:
         # Si no es propietario, devolver lista vacía (no error 403)
         return []
     
-    return await get_diagrams_by_project(project_id)
+    return _json_list_response(await get_diagrams_by_project(project_id))
 
 @app.get("/diagrams/{diagram_id}", response_model=Diagram)
 async def get_diagram(
@@ -309,36 +285,11 @@ async def get_diagram(
 ):
     """Get a specific diagram - users can access their own diagrams or shared ones."""
     # Check if token was sent but is invalid
-    auth_header = request.headers.get('authorization') or request.headers.get('Authorization')
-    token_was_sent = bool(auth_header)
-    token_is_valid = bool(current_user_email)
-    
-    user = None
-    if current_user_email:
-        user = await get_user_by_email(current_user_email)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
+    # ASGI header names are already lowercase bytes; scan them without building a Headers object
+    token_was_sent = any(name == b"authorization" and value for name, value in request.scope["headers"])
+    token_is_valid = current_user_email is not None
     
-    # Resolve possible share token (clients may send "shared-<token>" or just the token)
-    async def _resolve_diagram_id(maybe_id: str) -> str | None:
-        import uuid as _uuid
-        # If it's a valid UUID, return as-is
-        try:
-            _uuid.UUID(maybe_id)
-            return maybe_id
-        except Exception:
-            # Strip common prefix if present and try to load a share
-            token = maybe_id
-            if token.startswith("shared-"):
-                token = token[len("shared-"):]
-            share = await get_share_by_token(token)
-            if not share:
-                return None
-            return share.get("diagram_id")
-
+    # Resolve possible share token to a real diagram UUID
     resolved_id = await _resolve_diagram_id(diagram_id)
     if not resolved_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Diagram not found")
@@ -350,40 +301,34 @@ async def get_diagram(
             detail="Diagram not found"
         )
     
+    # Token was sent but is invalid/expired - return 401 immediately
+    if token_was_sent and not token_is_valid:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired authentication token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    # Shared-link reads ("shared-<token>") are allowed for anyone; the share was
+    # just looked up by _resolve_diagram_id, so this is served from cache
+    if diagram_id.startswith("shared-"):
+        share = await get_share_by_token(diagram_id[len("shared-"):])
+        if share and share.get('diagram_id') == resolved_id:
+            return diagram
+    
     # CRITICAL: Verify ownership or valid share token
-    if user:
-        is_owner = await verify_project_owner(diagram.project_id, user.id)
-        
-        # Si no es propietario, verificar si hay un share token válido
+    if current_user_email:
+        # Ownership checked by email in one joined query, no separate user lookup
+        is_owner = await verify_owner_by_email(diagram.project_id, current_user_email)
         if not is_owner:
-            # Check if this is a share token access (diagram_id starts with "shared-")
-            token_candidate = diagram_id
-            if token_candidate.startswith("shared-"):
-                token_candidate = token_candidate[len("shared-"):]
-                share = await get_share_by_token(token_candidate)
-                if share and share.get('diagram_id') == resolved_id:
-                    # Valid share token for this diagram, allow access
-                    return diagram
             # No valid share token and not owner -> deny access
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Access denied: You don't own this diagram and no valid share token found"
             )
     else:
-        # No authenticated user: check if token was sent but invalid
-        if token_was_sent and not token_is_valid:
-            # Token was sent but is invalid/expired - return 401 immediately
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid or expired authentication token",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        
         # No token sent: must have valid share token
-        token_candidate = diagram_id
-        if token_candidate.startswith("shared-"):
-            token_candidate = token_candidate[len("shared-"):]
-        share = await get_share_by_token(token_candidate)
+        share = await get_share_by_token(diagram_id)
         if not share or share.get('diagram_id') != resolved_id:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -396,33 +341,10 @@ async def get_diagram(
 async def update_existing_diagram(
     diagram_id: str,
     diagram_update: DiagramUpdate,
-    current_user_email: str | None = Depends(get_current_user_email_optional)
+    user: UserInDB | None = Depends(get_current_user_optional)
 ):
     """Update a diagram - users can edit their own diagrams or shared ones."""
-    user = None
-    if current_user_email:
-        user = await get_user_by_email(current_user_email)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-    
     # Resolve possible share token to a real diagram UUID
-    async def _resolve_diagram_id(maybe_id: str) -> str | None:
-        import uuid as _uuid
-        try:
-            _uuid.UUID(maybe_id)
-            return maybe_id
-        except Exception:
-            token = maybe_id
-            if token.startswith("shared-"):
-                token = token[len("shared-"):]
-            share = await get_share_by_token(token)
-            if not share:
-                return None
-            return share.get("diagram_id")
-
     resolved_id = await _resolve_diagram_id(diagram_id)
     if not resolved_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Diagram not found")
@@ -469,40 +391,17 @@ async def update_existing_diagram(
     
     # Broadcast update to all listeners
     user_id = str(user.id) if user else None
-    await broadcast_update(resolved_id, updated_diagram.diagram_data, user_id)
+    await broadcast_update(resolved_id, updated_diagram.diagram_data, updated_diagram.version, user_id)
     
     return updated_diagram
 
 @app.delete("/diagrams/{diagram_id}")
 async def delete_diagram_endpoint(
     diagram_id: str,
-    current_user_email: str | None = Depends(get_current_user_email_optional)
+    user: UserInDB | None = Depends(get_current_user_optional)
 ):
     """Delete a diagram."""
-    user = None
-    if current_user_email:
-        user = await get_user_by_email(current_user_email)
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="User not found"
-            )
-    
-    # Resolve share tokens to the underlying diagram id if necessary
-    async def _resolve_diagram_id(maybe_id: str) -> str | None:
-        import uuid as _uuid
-        try:
-            _uuid.UUID(maybe_id)
-            return maybe_id
-        except Exception:
-            token = maybe_id
-            if token.startswith("shared-"):
-                token = token[len("shared-"):]
-            share = await get_share_by_token(token)
-            if not share:
-                return None
-            return share.get("diagram_id")
-
+    # Resolve possible share token to a real diagram UUID
     resolved_id = await _resolve_diagram_id(diagram_id)
     if not resolved_id:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Diagram not found")
@@ -529,6 +428,12 @@ async def delete_diagram_endpoint(
     return {"message": "Diagram deleted successfully"}
 
 # Server-Sent Events endpoint for real-time updates
+# Static SSE frames, encoded once
+_KEEPALIVE_FRAME = b": keepalive\n\n"
+
+# Idle seconds before a keepalive comment; well under common proxy idle limits
+SSE_KEEPALIVE_SECONDS = 45.0
+
 @app.get("/diagrams/{diagram_id}/stream")
 async def stream_diagram_updates(
     diagram_id: str,
@@ -538,30 +443,14 @@ async def stream_diagram_updates(
     Stream real-time updates for a diagram using Server-Sent Events (SSE).
     Clients connect to this endpoint to receive updates when the diagram changes.
     """
-    # Resolve share token if needed
-    async def _resolve_diagram_id(maybe_id: str) -> str | None:
-        import uuid as _uuid
-        try:
-            _uuid.UUID(maybe_id)
-            return maybe_id
-        except Exception:
-            token = maybe_id
-            if token.startswith("shared-"):
-                token = token[len("shared-"):]
-            share = await get_share_by_token(token)
-            if not share:
-                return None
-            return share.get("diagram_id")
-    
     # First try to resolve the diagram ID
     resolved_id = await _resolve_diagram_id(diagram_id)
     
     # If resolution failed, check if it's a valid UUID (might be a real diagram ID)
     if not resolved_id:
-        import uuid as _uuid
         try:
             # Try to validate as UUID
-            _uuid.UUID(diagram_id)
+            uuid.UUID(diagram_id)
             resolved_id = diagram_id
         except Exception:
             # Not a valid UUID and not a share token - return 404
@@ -572,51 +461,52 @@ async def stream_diagram_updates(
     if not diagram:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Diagram not found")
     
-    # Try to get token from query param (EventSource doesn't support custom headers)
-    token = request.query_params.get("token")
-    if token:
-        # Verify token if provided
-        from auth import verify_token
-        email = verify_token(token)
-        if email:
-            user = await get_user_by_email(email)
-            # User is authenticated, allow access
-        # If token is invalid, still allow (for share tokens)
-    
-    # Create a queue for this connection
-    queue = asyncio.Queue()
+    # Last update the client has seen: browsers send Last-Event-ID when they
+    # reconnect on their own, and the frontend passes ?last_event_id= when it
+    # opens a fresh EventSource
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
     
     async def event_generator():
+        # Add this connection to listeners using the RESOLVED diagram_id (real UUID)
+        # This ensures all users (whether using share token or direct ID) connect to the same stream
+        channel = await add_listener(resolved_id)
+        last_seq = channel.seq
         try:
-            # Add this connection to listeners using the RESOLVED diagram_id (real UUID)
-            # This ensures all users (whether using share token or direct ID) connect to the same stream
-            await add_listener(resolved_id, queue)
-            
             # Send initial connection message with resolved ID
-            yield f"data: {json.dumps({'type': 'connected', 'diagram_id': resolved_id, 'original_id': diagram_id})}\n\n"
+            yield sse_frame(orjson.dumps({'type': 'connected', 'diagram_id': resolved_id, 'original_id': diagram_id}))
+            
+            # Replay the latest broadcast only to a reconnecting client that missed it;
+            # a client without an event id has just loaded the diagram, and replaying
+            # an older snapshot would overwrite its local edits
+            if last_event_id:
+                last_frame = get_missed_frame(resolved_id, last_event_id)
+                if last_frame is not None:
+                    yield last_frame
             
             # Keep connection alive and send updates
             while True:
                 try:
                     # Wait for update with timeout to send keepalive
                     try:
-                        message = await asyncio.wait_for(queue.get(), timeout=30.0)
-                        yield f"data: {message}\n\n"
+                        # Frames are complete SSE frames built once by broadcast_update
+                        frames, last_seq = await wait_for_frames(channel, last_seq, SSE_KEEPALIVE_SECONDS)
+                        for frame in frames:
+                            yield frame
                     except asyncio.TimeoutError:
                         # Send keepalive ping
-                        yield f": keepalive\n\n"
+                        yield _KEEPALIVE_FRAME
                         continue
                         
                 except asyncio.CancelledError:
                     break
                 except Exception as e:
                     # Send error and break
-                    yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+                    yield sse_frame(orjson.dumps({'type': 'error', 'message': str(e)}))
                     break
                     
         finally:
             # Remove listener when connection closes
-            await remove_listener(resolved_id, queue)
+            await remove_listener(resolved_id, channel)
     
     return StreamingResponse(
         event_generator(),
@@ -631,12 +521,24 @@ async def stream_diagram_updates(
 if __name__ == "__main__":
     import uvicorn
     import os
+    import sys
 
     # Use PORT from environment (Railway provides this) or default to 8000
     port = int(os.getenv("PORT", 8000))
 
-    # Run FastAPI app
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # SSE listeners live in process memory, so keep one worker unless a shared
+    # broadcast backend is configured
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+
+    # Run FastAPI app on uvloop + httptools (uvloop has no Windows build)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=workers,
+    )
 
 # Backwards-compatible export for platforms/configs that expect `asgi_app`
 asgi_app = app
\ No newline at end of file
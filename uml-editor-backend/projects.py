@@ -1,30 +1,82 @@
-from typing import List, Optional
+from typing import Any, Dict, Final, List, Optional, Tuple
 from datetime import datetime
 import uuid
+import orjson
 from models import ProjectCreate, Project
-from database import database
+from database import get_pool, rows_affected
+from diagrams import delete_diagrams_by_project
+
+_SQL_CREATE_PROJECT = """
+    INSERT INTO projects (id, name, owner_id, created_at, updated_at)
+    VALUES ($1, $2, $3, $4, $5)
+    RETURNING id, name, owner_id, created_at, updated_at
+"""
+
+_SQL_GET_PROJECT_BY_ID = "SELECT id, name, owner_id, created_at, updated_at FROM projects WHERE id = $1"
+
+# Built as one jsonb list in Postgres, already shaped like the Project schema
+_SQL_GET_PROJECTS_BY_OWNER = """
+    SELECT jsonb_agg(
+        jsonb_build_object(
+            'id', id::text,
+            'name', name,
+            'owner_id', owner_id::text,
+            'created_at', created_at,
+            'updated_at', updated_at
+        )
+        ORDER BY created_at DESC
+    )
+    FROM projects WHERE owner_id = $1
+"""
+
+_SQL_VERIFY_OWNER_BY_EMAIL = """
+    SELECT EXISTS (
+        SELECT 1 FROM projects p JOIN users u ON u.id = p.owner_id
+        WHERE p.id = $1 AND u.email = $2
+    )
+"""
+
+_SQL_GET_PROJECT_FOR_EMAIL = """
+    SELECT p.id, p.name, p.owner_id, p.created_at, p.updated_at, COALESCE(u.email = $2, FALSE) AS is_owner
+    FROM projects p LEFT JOIN users u ON u.id = p.owner_id
+    WHERE p.id = $1
+"""
+
+_SQL_DELETE_PROJECT = "DELETE FROM projects WHERE id = $1"
+
+# Project and its default diagram in one statement: a single round-trip, and
+# both rows commit (or fail) together, so there are no orphaned projects.
+_SQL_CREATE_PROJECT_WITH_DEFAULT_DIAGRAM = """
+    WITH p AS (
+        INSERT INTO projects (id, name, owner_id, created_at, updated_at)
+        VALUES ($1, $2, $3, $4, $4)
+        RETURNING id, name, owner_id, created_at, updated_at
+    ), d AS (
+        INSERT INTO diagrams (project_id, diagram_data, version, created_at, updated_at)
+        SELECT id, $5::text::jsonb, 1, created_at, created_at FROM p
+    )
+    SELECT id, name, owner_id, created_at, updated_at FROM p
+"""
+
+_DEFAULT_DIAGRAM_DATA: Final[dict] = {
+    "classes": [],
+    "associations": [],
+    "metadata": {
+        "created": "auto",
+        "description": "Default diagram for project"
+    }
+}
+
+# Encoded once; the query casts the text straight to jsonb
+_DEFAULT_DIAGRAM_JSON: Final[str] = orjson.dumps(_DEFAULT_DIAGRAM_DATA).decode()
 
 async def create_project(project_create: ProjectCreate, owner_id: str) -> Project:
     """Create a new project."""
     project_id = uuid.uuid4()
     created_at = datetime.utcnow()
     
-    query = """
-        INSERT INTO projects (id, name, owner_id, created_at, updated_at)
-        VALUES (:id, :name, :owner_id, :created_at, :updated_at)
-        RETURNING id, name, owner_id, created_at, updated_at
-    """
-    
-    result = await database.fetch_one(
-        query=query,
-        values={
-            "id": project_id,
-            "name": project_create.name,
-            "owner_id": owner_id,
-            "created_at": created_at,
-            "updated_at": created_at
-        }
-    )
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(_SQL_CREATE_PROJECT, project_id, project_create.name, owner_id, created_at, created_at)
     
     return Project(
         id=str(result["id"]),
@@ -36,8 +88,8 @@ async def create_project(project_create: ProjectCreate, owner_id: str) -> Projec
 
 async def get_project_by_id(project_id: str) -> Optional[Project]:
     """Get project by ID."""
-    query = "SELECT id, name, owner_id, created_at, updated_at FROM projects WHERE id = :project_id"
-    result = await database.fetch_one(query=query, values={"project_id": project_id})
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(_SQL_GET_PROJECT_BY_ID, project_id)
     
     if result:
         return Project(
@@ -49,27 +101,39 @@ async def get_project_by_id(project_id: str) -> Optional[Project]:
         )
     return None
 
-async def get_projects_by_owner(owner_id: str) -> List[Project]:
+async def get_projects_by_owner(owner_id: str) -> List[Dict[str, Any]]:
     """Get all projects owned by a user."""
-    query = "SELECT id, name, owner_id, created_at, updated_at FROM projects WHERE owner_id = :owner_id ORDER BY created_at DESC"
-    results = await database.fetch_all(query=query, values={"owner_id": owner_id})
+    async with get_pool().acquire() as conn:
+        projects = await conn.fetchval(_SQL_GET_PROJECTS_BY_OWNER, owner_id)
     
-    return [
-        Project(
-            id=str(row["id"]),
-            name=row["name"],
-            owner_id=str(row["owner_id"]),
-            created_at=row["created_at"],
-            updated_at=row["updated_at"]
-        )
-        for row in results
-    ]
+    return projects or []
 
 async def verify_project_owner(project_id: str, user_id: str) -> bool:
     """Verify if a user owns a project."""
     project = await get_project_by_id(project_id)
     return project is not None and project.owner_id == user_id
 
+async def verify_owner_by_email(project_id: str, email: str) -> bool:
+    """Verify if the user with this email owns a project, in a single query."""
+    async with get_pool().acquire() as conn:
+        return await conn.fetchval(_SQL_VERIFY_OWNER_BY_EMAIL, project_id, email)
+
+async def get_project_for_email(project_id: str, email: str) -> Tuple[Optional[Project], bool]:
+    """Get a project and whether the user with this email owns it, in a single query."""
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(_SQL_GET_PROJECT_FOR_EMAIL, project_id, email)
+    
+    if not result:
+        return None, False
+    project = Project(
+        id=str(result["id"]),
+        name=result["name"],
+        owner_id=str(result["owner_id"]),
+        created_at=result["created_at"],
+        updated_at=result["updated_at"]
+    )
+    return project, result["is_owner"]
+
 async def delete_project(project_id: str, user_id: str) -> bool:
     """Delete a project and all its diagrams."""
     # First verify ownership
@@ -77,38 +141,33 @@ async def delete_project(project_id: str, user_id: str) -> bool:
         return False
     
     # Delete all diagrams first (cascade delete)
-    from diagrams import delete_diagrams_by_project
     await delete_diagrams_by_project(project_id)
     
     # Delete the project
-    query = "DELETE FROM projects WHERE id = :project_id"
-    result = await database.execute(query=query, values={"project_id": project_id})
+    async with get_pool().acquire() as conn:
+        status = await conn.execute(_SQL_DELETE_PROJECT, project_id)
     
-    return result > 0
+    return rows_affected(status) > 0
 
 async def create_project_with_default_diagram(project_create: ProjectCreate, owner_id: str) -> Project:
     """Create a new project with a default diagram."""
-    # Create the project first
-    project = await create_project(project_create, owner_id)
-    
-    # Create a default diagram for the project
-    from diagrams import create_diagram
-    from models import DiagramCreate
-    
-    default_diagram_data = {
-        "classes": [],
-        "associations": [],
-        "metadata": {
-            "created": "auto",
-            "description": "Default diagram for project"
-        }
-    }
-    
-    default_diagram = DiagramCreate(
-        project_id=project.id,
-        diagram_data=default_diagram_data
-    )
+    project_id = uuid.uuid4()
+    created_at = datetime.utcnow()
     
-    await create_diagram(default_diagram)
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(
+            _SQL_CREATE_PROJECT_WITH_DEFAULT_DIAGRAM,
+            project_id,
+            project_create.name,
+            owner_id,
+            created_at,
+            _DEFAULT_DIAGRAM_JSON,
+        )
     
-    return project
\ No newline at end of file
+    return Project(
+        id=str(result["id"]),
+        name=result["name"],
+        owner_id=str(result["owner_id"]),
+        created_at=result["created_at"],
+        updated_at=result["updated_at"]
+    )
\ No newline at end of file
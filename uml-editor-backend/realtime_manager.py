@@ -2,68 +2,176 @@
 Real-time collaboration manager using Server-Sent Events (SSE)
 Simple in-memory implementation for real-time updates
 """
-from typing import Dict, Set, Callable, Any
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple, Any
 import asyncio
-import json
+import logging
+import secrets
+import orjson
+from cachetools import LRUCache
 from datetime import datetime
 
-# Store active SSE connections per diagram
-# Format: {diagram_id: Set[queue]}
-diagram_listeners: Dict[str, Set[asyncio.Queue]] = {}
+logger = logging.getLogger(__name__)
 
-# Store last update timestamp per diagram
-diagram_last_update: Dict[str, datetime] = {}
+# Frames kept per diagram. Updates are full-state snapshots, so a client that
+# falls further behind can safely skip the older ones.
+LISTENER_QUEUE_SIZE = 16
 
+# Updates for the same diagram arriving within this window are coalesced and
+# only the latest state is sent (dragging a node emits a burst of saves)
+BROADCAST_COALESCE_SECONDS = 0.05
 
-async def add_listener(diagram_id: str, queue: asyncio.Queue):
-    """Add a listener queue for a diagram."""
-    if diagram_id not in diagram_listeners:
-        diagram_listeners[diagram_id] = set()
-    diagram_listeners[diagram_id].add(queue)
+# Update frames larger than this drop diagram_data and carry only the version,
+# so a large diagram isn't pushed to every listener on each save; clients GET
+# the diagram when they see a version without data.
+INLINE_DIAGRAM_MAX_BYTES = 64 * 1024
 
 
-async def remove_listener(diagram_id: str, queue: asyncio.Queue):
-    """Remove a listener queue for a diagram."""
-    if diagram_id in diagram_listeners:
-        diagram_listeners[diagram_id].discard(queue)
-        if not diagram_listeners[diagram_id]:
-            del diagram_listeners[diagram_id]
+class DiagramChannel:
+    """Shared broadcast state for one diagram: recent frames plus a wakeup condition."""
 
+    def __init__(self, seq: int = 0):
+        self.frames: deque = deque(maxlen=LISTENER_QUEUE_SIZE)  # (seq, frame)
+        self.seq = seq
+        self.condition = asyncio.Condition()
+        self.listeners = 0
 
-async def broadcast_update(diagram_id: str, diagram_data: Dict[str, Any], user_id: str = None):
-    """Broadcast an update to all listeners of a diagram."""
-    if diagram_id not in diagram_listeners:
-        return
-    
-    # Update timestamp
-    diagram_last_update[diagram_id] = datetime.utcnow()
+
+# Store active SSE channels per diagram
+# Format: {diagram_id: DiagramChannel}
+diagram_channels: Dict[str, DiagramChannel] = {}
+
+# Last update per diagram as (seq, timestamp, SSE frame), kept even while nobody
+# is listening so a client that (re)connects gets current state without a DB
+# read. seq is the monotonic update counter sent to clients; it carries on
+# across channel teardown and reconnects. Bounded so diagrams that stop
+# changing eventually fall out.
+diagram_last_state: LRUCache = LRUCache(maxsize=1024)
+
+# Per-process epoch prefixed to SSE event ids ("<boot_id>:<seq>"). seq lives in
+# memory and restarts after a restart or redeploy, so a client id from another
+# epoch can't be compared by seq and always gets the current state replayed.
+_BOOT_ID = secrets.token_hex(4).encode("ascii")
+
+# Latest not-yet-sent update per diagram: (diagram_data, version, user_id)
+_pending_updates: Dict[str, Tuple[Dict[str, Any], int, Optional[str]]] = {}
+
+# Strong references to scheduled flushes so they aren't garbage collected
+_flush_tasks: Set[asyncio.Task] = set()
+
+
+def sse_frame(payload: bytes, event_id: Optional[bytes] = None) -> bytes:
+    """Wrap an already-serialized JSON payload as an SSE data frame, optionally with an id."""
+    if event_id is not None:
+        return b"id: " + event_id + b"\ndata: " + payload + b"\n\n"
+    return b"data: " + payload + b"\n\n"
+
+
+async def add_listener(diagram_id: str) -> DiagramChannel:
+    """Register a listener on a diagram's channel, creating the channel if needed."""
+    channel = diagram_channels.get(diagram_id)
+    if channel is None:
+        channel = diagram_channels[diagram_id] = DiagramChannel(_last_seq(diagram_id))
+    channel.listeners += 1
+    return channel
+
+
+async def remove_listener(diagram_id: str, channel: DiagramChannel):
+    """Unregister a listener and drop the channel once nobody is listening."""
+    channel.listeners -= 1
+    if channel.listeners <= 0 and diagram_channels.get(diagram_id) is channel:
+        del diagram_channels[diagram_id]
+
+
+async def wait_for_frames(channel: DiagramChannel, last_seq: int, timeout: float) -> Tuple[List[bytes], int]:
+    """Wait until frames newer than last_seq exist; return them with the new sequence number.
+
+    Raises asyncio.TimeoutError if nothing arrives within timeout.
+    """
+    if channel.seq == last_seq:
+        async with channel.condition:
+            await asyncio.wait_for(channel.condition.wait_for(lambda: channel.seq != last_seq), timeout)
+    return [frame for seq, frame in channel.frames if seq > last_seq], channel.seq
+
+
+def get_missed_frame(diagram_id: str, last_event_id: str) -> Optional[bytes]:
+    """Return the most recent update frame for a diagram unless the client has already seen it."""
+    state = diagram_last_state.get(diagram_id)
+    if not state:
+        return None
+    boot_id, _, seq = last_event_id.partition(":")
+    # Same epoch: seqs are comparable. Another epoch or a malformed id: resync
+    if boot_id.encode("ascii", "replace") == _BOOT_ID and seq.isdigit() and int(seq) >= state[0]:
+        return None
+    return state[2]
+
+
+async def broadcast_update(diagram_id: str, diagram_data: Dict[str, Any], version: int, user_id: str = None):
+    """Broadcast an update to all listeners of a diagram, coalescing rapid bursts."""
+    first = diagram_id not in _pending_updates
+    # Each update carries the full diagram state, so a newer one simply replaces it
+    _pending_updates[diagram_id] = (diagram_data, version, user_id)
+    if first:
+        task = asyncio.create_task(_flush_after_window(diagram_id))
+        _flush_tasks.add(task)
+        task.add_done_callback(_flush_tasks.discard)
+
+
+async def _flush_after_window(diagram_id: str):
+    """Wait out the coalescing window, then publish the latest pending update."""
+    await asyncio.sleep(BROADCAST_COALESCE_SECONDS)
+    diagram_data, version, user_id = _pending_updates.pop(diagram_id)
+    try:
+        await _publish_update(diagram_id, diagram_data, version, user_id)
+    except Exception:
+        # Nobody awaits this task, so report the failure here instead of at GC time
+        logger.exception("Failed to broadcast update for diagram %s", diagram_id)
+
+
+async def _publish_update(diagram_id: str, diagram_data: Dict[str, Any], version: int, user_id: Optional[str]):
+    """Build one update frame and fan it out to the diagram's listeners."""
+    channel = diagram_channels.get(diagram_id)
+    # A live channel keeps counting even if its state fell out of the LRU
+    seq = max(_last_seq(diagram_id), channel.seq if channel else 0) + 1
+    # Human-facing timestamp kept for the frontend's message type; ordering uses seq
+    timestamp = datetime.utcnow()
     
-    # Prepare update message
-    message = {
+    # Prepare the version pointer (orjson writes the datetime as ISO 8601 itself)
+    payload = orjson.dumps({
         "type": "update",
         "diagram_id": diagram_id,
-        "diagram_data": diagram_data,
-        "timestamp": diagram_last_update[diagram_id].isoformat(),
+        "version": version,
+        "seq": seq,
+        "timestamp": timestamp,
         "user_id": user_id
-    }
+    })
     
-    # Send to all listeners
-    message_json = json.dumps(message)
-    disconnected = set()
+    # diagram_data is encoded on its own and spliced in, so each part is
+    # serialized exactly once; too large to inline means clients GET it instead
+    data = orjson.dumps(diagram_data)
+    if len(payload) + len(data) <= INLINE_DIAGRAM_MAX_BYTES:
+        payload = payload[:-1] + b',"diagram_data":' + data + b"}"
+    frame = sse_frame(payload, b"%s:%d" % (_BOOT_ID, seq))
+    diagram_last_state[diagram_id] = (seq, timestamp, frame)
     
-    for queue in diagram_listeners[diagram_id]:
-        try:
-            await queue.put(message_json)
-        except Exception:
-            # Queue is closed or disconnected
-            disconnected.add(queue)
+    if channel is None:
+        return
     
-    # Clean up disconnected listeners
-    for queue in disconnected:
-        await remove_listener(diagram_id, queue)
+    # One shared frame and one notify_all, however many listeners there are
+    channel.seq = seq
+    channel.frames.append((seq, frame))
+    async with channel.condition:
+        channel.condition.notify_all()
+
+
+def _last_seq(diagram_id: str) -> int:
+    """Get the update counter for a diagram (0 if it has never been broadcast)."""
+    state = diagram_last_state.get(diagram_id)
+    return state[0] if state else 0
 
 
 async def get_last_update_time(diagram_id: str) -> datetime | None:
     """Get the last update time for a diagram."""
-    return diagram_last_update.get(diagram_id)
+    state = diagram_last_state.get(diagram_id)
+    return state[1] if state else None
 
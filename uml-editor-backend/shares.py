@@ -1,91 +1,75 @@
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
-import uuid
-import json
-from database import database
-
+from cachetools import TTLCache
+from database import get_pool
+
+# Active shares by token, kept briefly so shared-link views, edits and SSE
+# reconnects don't query Postgres every time. Expiry is re-checked on each hit.
+_share_cache: TTLCache = TTLCache(maxsize=8192, ttl=30)
+
+_SQL_CREATE_SHARE = """
+    INSERT INTO shares (token, diagram_id, owner_id, diagram_data, created_at, expires_at, is_active)
+    VALUES ($1, $2, $3, $4, $5, $6, $7)
+    RETURNING token, diagram_id, owner_id, diagram_data, created_at, expires_at, is_active
+"""
+
+# Inactive and expired shares are filtered out by Postgres
+_SQL_GET_SHARE_BY_TOKEN = """
+    SELECT token, diagram_id, owner_id, diagram_data, created_at, expires_at, is_active FROM shares
+    WHERE token = $1 AND is_active = TRUE AND (expires_at IS NULL OR expires_at >= $2)
+"""
+
+_SQL_GET_SHARES_BY_DIAGRAM_ID = """
+    SELECT token, diagram_id, owner_id, diagram_data, created_at, expires_at, is_active FROM shares
+    WHERE diagram_id = $1 AND is_active = TRUE AND (expires_at IS NULL OR expires_at >= $2)
+"""
 
 async def create_share(token: str, diagram_id: str, owner_id: Optional[str], diagram_data: Dict[str, Any], expires_hours: Optional[int] = 24) -> dict:
     created_at = datetime.utcnow()
     expires_at = (created_at + timedelta(hours=expires_hours)) if expires_hours else None
 
-    query = """
-        INSERT INTO shares (token, diagram_id, owner_id, diagram_data, created_at, expires_at, is_active)
-        VALUES (:token, :diagram_id, :owner_id, :diagram_data, :created_at, :expires_at, :is_active)
-        RETURNING token, diagram_id, owner_id, diagram_data, created_at, expires_at, is_active
-    """
-
-    result = await database.fetch_one(
-        query=query,
-        values={
-            'token': token,
-            'diagram_id': diagram_id,
-            'owner_id': owner_id,
-            'diagram_data': json.dumps(diagram_data) if diagram_data is not None else None,
-            'created_at': created_at,
-            'expires_at': expires_at,
-            'is_active': True
-        }
-    )
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(
+            _SQL_CREATE_SHARE,
+            token,
+            diagram_id,
+            owner_id,
+            diagram_data,
+            created_at,
+            expires_at,
+            True,
+        )
 
     if not result:
         return None
 
-    data = dict(result)
-    if data.get('diagram_data') and isinstance(data['diagram_data'], str):
-        try:
-            data['diagram_data'] = json.loads(data['diagram_data'])
-        except Exception:
-            pass
-    return data
+    _share_cache.pop(token, None)
+
+    return dict(result)
 
 
 async def get_share_by_token(token: str) -> Optional[dict]:
-    query = "SELECT token, diagram_id, owner_id, diagram_data, created_at, expires_at, is_active FROM shares WHERE token = :token"
-    result = await database.fetch_one(query=query, values={'token': token})
+    cached = _share_cache.get(token)
+    if cached is not None:
+        if cached.get('expires_at') and cached['expires_at'] < datetime.utcnow():
+            _share_cache.pop(token, None)
+            return None
+        return cached
+
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(_SQL_GET_SHARE_BY_TOKEN, token, datetime.utcnow())
 
     if not result:
         return None
 
     data = dict(result)
-    if data.get('diagram_data') and isinstance(data['diagram_data'], str):
-        try:
-            data['diagram_data'] = json.loads(data['diagram_data'])
-        except Exception:
-            pass
-
-    # Expiration check
-    if data.get('expires_at'):
-        from datetime import datetime
-        if data['expires_at'] < datetime.utcnow():
-            return None
-
-    if not data.get('is_active'):
-        return None
-
+    _share_cache[token] = data
     return data
 
 
 async def get_shares_by_diagram_id(diagram_id: str) -> list[dict]:
     """Get all active shares for a diagram."""
-    query = "SELECT token, diagram_id, owner_id, diagram_data, created_at, expires_at, is_active FROM shares WHERE diagram_id = :diagram_id AND is_active = TRUE"
-    results = await database.fetch_all(query=query, values={'diagram_id': diagram_id})
-
-    shares = []
-    for result in results:
-        data = dict(result)
-        if data.get('diagram_data') and isinstance(data['diagram_data'], str):
-            try:
-                data['diagram_data'] = json.loads(data['diagram_data'])
-            except Exception:
-                pass
-
-        # Expiration check
-        if data.get('expires_at'):
-            from datetime import datetime
-            if data['expires_at'] < datetime.utcnow():
-                continue
-
-        shares.append(data)
-
-    return shares
\ No newline at end of file
+    async with get_pool().acquire() as conn:
+        results = await conn.fetch(_SQL_GET_SHARES_BY_DIAGRAM_ID, diagram_id, datetime.utcnow())
+
+    return [dict(result) for result in results]
\ No newline at end of file
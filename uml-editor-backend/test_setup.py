@@ -7,6 +7,7 @@ Ejecuta este script después de configurar PostgreSQL y antes de iniciar el serv
 import os
 import sys
 import asyncio
+import importlib.util
 from dotenv import load_dotenv
 
 # Cargar variables de entorno
@@ -47,26 +48,26 @@ async def test_database_connection():
     print("🗄️  Probando conexión a la base de datos...")
     
     try:
-        from database import connect_db, disconnect_db, database
+        from database import connect_db, disconnect_db, get_pool
         
         await connect_db()
         print("  ✅ Conexión a PostgreSQL exitosa")
         
-        # Verificar que las tablas existen
+        # Verificar que las tablas existen (solo se consultan las esperadas)
+        expected_tables = ['users', 'projects', 'diagrams', 'shares']
         query = """
             SELECT table_name 
             FROM information_schema.tables 
-            WHERE table_schema = 'public'
+            WHERE table_schema = 'public' AND table_name = ANY($1::text[])
             ORDER BY table_name;
         """
-        tables = await database.fetch_all(query)
+        tables = await get_pool().fetch(query, expected_tables)
         table_names = [row[0] for row in tables]
         
-        expected_tables = ['users', 'projects', 'diagrams', 'shares']
-        missing_tables = [t for t in expected_tables if t not in table_names]
+        missing_tables = set(expected_tables) - set(table_names)
         
         if missing_tables:
-            print(f"  ⚠️  Tablas faltantes: {', '.join(missing_tables)}")
+            print(f"  ⚠️  Tablas faltantes: {', '.join(sorted(missing_tables))}")
             print("     Ejecuta: psql -U postgres -d uml_editor -f init_database.sql")
             await disconnect_db()
             return False
@@ -92,10 +93,11 @@ def test_imports():
     required_modules = [
         'fastapi',
         'uvicorn',
-        'databases',
         'asyncpg',
-        'jose',
-        'passlib',
+        'jwt',
+        'bcrypt',
+        'orjson',
+        'cachetools',
         'python_dotenv'
     ]
     
@@ -106,10 +108,10 @@ def test_imports():
             import_name = module.replace('-', '_')
             if module == 'python_dotenv':
                 import_name = 'dotenv'
-            elif module == 'jose':
-                import_name = 'jose.jwt'
             
-            __import__(import_name)
+            # find_spec solo comprueba que el módulo exista, sin ejecutarlo
+            if importlib.util.find_spec(import_name) is None:
+                raise ImportError(module)
             print(f"  ✅ {module}")
         except ImportError:
             missing.append(module)
@@ -1,122 +1,138 @@
-from typing import Optional
+from typing import Optional, Set
 from datetime import datetime
+import asyncio
 import uuid
 from models import UserCreate, UserInDB, User
 from auth import get_password_hash, verify_and_maybe_upgrade_password
-from database import database
+from database import get_pool
+
+_SQL_GET_USER_BY_EMAIL = "SELECT id, email, username, hashed_password, is_active, created_at FROM users WHERE email = $1"
+
+_SQL_GET_USER_BY_USERNAME = "SELECT id, email, username, hashed_password, is_active, created_at FROM users WHERE username = $1"
+
+_SQL_GET_ACTIVE_USER_BY_EMAIL = "SELECT id, email, username, hashed_password, is_active, created_at FROM users WHERE email = $1 AND is_active = true"
+
+# Unique constraints still guard against a concurrent registration that slips
+# past the pre-check in create_user
+_SQL_CREATE_USER = """
+    INSERT INTO users (id, email, username, hashed_password, is_active, created_at)
+    VALUES ($1, $2, $3, $4, $5, $6)
+    ON CONFLICT DO NOTHING
+    RETURNING id, email, username, hashed_password, is_active, created_at
+"""
+
+_SQL_FIND_USER_CONFLICT = "SELECT bool_or(email = $1) AS email_taken, bool_or(username = $2) AS username_taken FROM users WHERE email = $1 OR username = $2"
+
+_SQL_UPDATE_PASSWORD_HASH = "UPDATE users SET hashed_password = $1 WHERE id = $2"
+
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-flight
+_background_tasks: Set[asyncio.Task] = set()
+
+def _user_from_row(row) -> UserInDB:
+    """Build a UserInDB from a users row."""
+    # Rows come from our own schema, so model_construct() skips pydantic validation
+    return UserInDB.model_construct(
+        id=str(row["id"]),
+        email=row["email"],
+        username=row["username"],
+        hashed_password=row["hashed_password"],
+        is_active=row["is_active"],
+        created_at=row["created_at"]
+    )
 
 async def get_user_by_email(email: str) -> Optional[UserInDB]:
     """Get user by email."""
-    query = "SELECT id, email, username, hashed_password, is_active, created_at FROM users WHERE email = :email"
-    result = await database.fetch_one(query=query, values={"email": email})
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(_SQL_GET_USER_BY_EMAIL, email)
     
     if result:
-        return UserInDB(
-            id=str(result["id"]),
-            email=result["email"],
-            username=result["username"],
-            hashed_password=result["hashed_password"],
-            is_active=result["is_active"],
-            created_at=result["created_at"]
-        )
+        return _user_from_row(result)
     return None
 
 async def get_user_by_username(username: str) -> Optional[UserInDB]:
     """Get user by username."""
-    query = "SELECT id, email, username, hashed_password, is_active, created_at FROM users WHERE username = :username"
-    result = await database.fetch_one(query=query, values={"username": username})
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(_SQL_GET_USER_BY_USERNAME, username)
     
     if result:
-        return UserInDB(
-            id=str(result["id"]),
-            email=result["email"],
-            username=result["username"],
-            hashed_password=result["hashed_password"],
-            is_active=result["is_active"],
-            created_at=result["created_at"]
-        )
+        return _user_from_row(result)
     return None
 
-async def create_user(user_create: UserCreate) -> UserInDB:
-    """Create a new user."""
-    # Check if user already exists
-    existing_user = await get_user_by_email(user_create.email)
-    if existing_user:
+async def _raise_if_taken(conn, user_create: UserCreate):
+    """Raise ValueError naming the unique value (email or username) already in use."""
+    conflict = await conn.fetchrow(
+        _SQL_FIND_USER_CONFLICT,
+        user_create.email,
+        user_create.username,
+    )
+    if conflict["email_taken"]:
         raise ValueError("Email already registered")
-    
-    existing_user = await get_user_by_username(user_create.username)
-    if existing_user:
+    if conflict["username_taken"]:
         raise ValueError("Username already taken")
+
+async def create_user(user_create: UserCreate) -> UserInDB:
+    """Create a new user."""
+    # Cheap indexed check first so duplicate registrations don't pay for bcrypt
+    async with get_pool().acquire() as conn:
+        await _raise_if_taken(conn, user_create)
     
-    # Create new user
     user_id = uuid.uuid4()
-    hashed_password = get_password_hash(user_create.password)
+    hashed_password = await get_password_hash(user_create.password)
     created_at = datetime.utcnow()
     
-    query = """
-        INSERT INTO users (id, email, username, hashed_password, is_active, created_at)
-        VALUES (:id, :email, :username, :hashed_password, :is_active, :created_at)
-        RETURNING id, email, username, hashed_password, is_active, created_at
-    """
-    
-    result = await database.fetch_one(
-        query=query,
-        values={
-            "id": user_id,
-            "email": user_create.email,
-            "username": user_create.username,
-            "hashed_password": hashed_password,
-            "is_active": True,
-            "created_at": created_at
-        }
-    )
+    async with get_pool().acquire() as conn:
+        result = await conn.fetchrow(
+            _SQL_CREATE_USER,
+            user_id,
+            user_create.email,
+            user_create.username,
+            hashed_password,
+            True,
+            created_at,
+        )
+        
+        if not result:
+            # Lost a race with a concurrent registration: report what was taken
+            await _raise_if_taken(conn, user_create)
+            raise ValueError("Email or username already registered")
     
-    return UserInDB(
-        id=str(result["id"]),
-        email=result["email"],
-        username=result["username"],
-        hashed_password=result["hashed_password"],
-        is_active=result["is_active"],
-        created_at=result["created_at"]
-    )
+    return _user_from_row(result)
+
+async def _store_upgraded_hash(user_id: str, upgraded_hash: str):
+    """Best-effort write of a rehashed password; failures are ignored."""
+    try:
+        async with get_pool().acquire() as conn:
+            await conn.execute(_SQL_UPDATE_PASSWORD_HASH, upgraded_hash, user_id)
+    except Exception:
+        # Don't fail login if upgrade fails; it is retried on the next login
+        pass
 
 async def authenticate_user(email: str, password: str) -> Optional[UserInDB]:
     """Authenticate a user with email and password."""
     try:
         # Single database query with password verification
-        query = "SELECT id, email, username, hashed_password, is_active, created_at FROM users WHERE email = :email AND is_active = true"
-        result = await database.fetch_one(query=query, values={"email": email})
+        async with get_pool().acquire() as conn:
+            result = await conn.fetchrow(_SQL_GET_ACTIVE_USER_BY_EMAIL, email)
         
         if not result:
             return None
         
         # Verify password immediately
-        valid, upgraded_hash = verify_and_maybe_upgrade_password(password, result["hashed_password"])
+        valid, upgraded_hash = await verify_and_maybe_upgrade_password(password, result["hashed_password"])
         if not valid:
             return None
 
-        # If legacy hash was used, upgrade to bcrypt transparently
+        # If legacy hash was used, upgrade to bcrypt transparently; the write
+        # runs in the background so the login response doesn't wait on it
         if upgraded_hash:
-            try:
-                await database.execute(
-                    query="UPDATE users SET hashed_password = :hashed_password WHERE id = :id",
-                    values={"hashed_password": upgraded_hash, "id": result["id"]},
-                )
-                result = dict(result)
-                result["hashed_password"] = upgraded_hash
-            except Exception:
-                # Don't fail login if upgrade fails
-                pass
+            task = asyncio.create_task(_store_upgraded_hash(result["id"], upgraded_hash))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+            result = dict(result)
+            result["hashed_password"] = upgraded_hash
         
         # Return user object
-        return UserInDB(
-            id=str(result["id"]),
-            email=result["email"],
-            username=result["username"],
-            hashed_password=result["hashed_password"],
-            is_active=result["is_active"],
-            created_at=result["created_at"]
-        )
+        return _user_from_row(result)
     except Exception:
         return None
 
@@ -1,15 +1,18 @@
 import { useEffect, useRef } from 'react'
 import { logger } from '@/lib/logger'
-import { tokenManager } from '@/lib/api-client'
+import { apiClient, tokenManager } from '@/lib/api-client'
 import type { UMLClass, Association } from '@/types/uml'
 
 interface DiagramUpdate {
   type: string
   diagram_id: string
-  diagram_data: {
+  // Omitted for large diagrams; the version tells the client to fetch it
+  diagram_data?: {
     classes?: UMLClass[]
     associations?: Association[]
   }
+  version?: number
+  seq?: number
   timestamp: string
   user_id?: string
 }
@@ -32,6 +35,7 @@ export function useRealtimeSync({
   const reconnectAttemptsRef = useRef(0)
   const maxReconnectAttempts = 5
   const is404ErrorRef = useRef(false) // Track if we got a 404 (diagram doesn't exist)
+  const lastEventIdRef = useRef<string | null>(null) // Last SSE event id seen, sent on reconnect
 
   useEffect(() => {
     // Don't connect if disabled, no diagram ID, or diagram ID is invalid
@@ -69,7 +73,12 @@ export function useRealtimeSync({
       
       // Build SSE URL with token as query param
       const apiUrl = process.env.NEXT_PUBLIC_API_URL || '/api'
-      const url = `${apiUrl}/diagrams/${resolvedId}/stream${token ? `?token=${encodeURIComponent(token)}` : ''}`
+      // last_event_id lets the backend replay an update only if we missed one
+      const params = new URLSearchParams()
+      if (token) params.set('token', token)
+      if (lastEventIdRef.current) params.set('last_event_id', lastEventIdRef.current)
+      const query = params.toString()
+      const url = `${apiUrl}/diagrams/${resolvedId}/stream${query ? `?${query}` : ''}`
 
       logger.log('Connecting to SSE:', url)
 
@@ -98,7 +107,12 @@ export function useRealtimeSync({
             
             const data: DiagramUpdate = JSON.parse(event.data)
             
-            if (data.type === 'update' && data.diagram_data) {
+            if (data.type === 'update') {
+              // "<boot_id>:<seq>", opaque to the client
+              if (event.lastEventId) {
+                lastEventIdRef.current = event.lastEventId
+              }
+
               // Only update if it's not from current user (avoid loops)
               if (data.user_id && data.user_id === currentUserId) {
                 logger.log('Ignoring update from current user')
@@ -107,11 +121,24 @@ export function useRealtimeSync({
 
               logger.log('Received real-time update:', data)
               
-              // Update state with new data
-              onUpdate(
-                data.diagram_data.classes || [],
-                data.diagram_data.associations || []
-              )
+              if (data.diagram_data) {
+                // Update state with new data
+                onUpdate(
+                  data.diagram_data.classes || [],
+                  data.diagram_data.associations || []
+                )
+              } else {
+                // Version-only update: pull the current diagram state
+                // (anonymous share-link viewers fetch without a token)
+                apiClient.getDiagram(resolvedId, token)
+                  .then((diagram) => {
+                    onUpdate(
+                      diagram.diagram_data?.classes || [],
+                      diagram.diagram_data?.associations || []
+                    )
+                  })
+                  .catch((error) => logger.error('Error fetching updated diagram:', error))
+              }
             } else if (data.type === 'connected') {
               logger.log('SSE connected to diagram:', data.diagram_id)
             } else if (data.type === 'error') {
@@ -169,6 +196,7 @@ export function useRealtimeSync({
     // Reset 404 flag when diagram ID changes
     is404ErrorRef.current = false
     reconnectAttemptsRef.current = 0
+    lastEventIdRef.current = null
 
     // Initial connection
     connect()
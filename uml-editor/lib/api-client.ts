@@ -269,12 +269,13 @@ export const apiClient = {
     })
   },
 
-  getDiagram: async (diagramId: string, token: string): Promise<Diagram> => {
+  // token is optional: shared-<token> diagrams can be read anonymously
+  getDiagram: async (diagramId: string, token?: string | null): Promise<Diagram> => {
     return apiRequest<Diagram>(`/diagrams/${diagramId}`, {
       method: 'GET',
-      headers: {
+      headers: token ? {
         'Authorization': `Bearer ${token}`,
-      },
+      } : {},
     })
   },
 